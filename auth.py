@@ -1,18 +1,29 @@
 #!/usr/bin/env python3
 
+import hashlib
 import requests
-from fxa.core import Client
-from fxa.plugins.requests import FxABearerTokenAuth, FxABrowserIDAuth
+import threading
+import time
+from urllib.parse import urlparse
+from fxa.core import Client, Session
+from fxa.errors import ClientError
+from fxa.plugins.requests import FxABearerTokenAuth
 from requests_hawk import HawkAuth
 from fxa.crypto import derive_key, calculate_hmac
 
+# TODO: pull out the urls to be part of the config.
+ACCOUNTS_URL     = "https://api.accounts.firefox.com"
+TOKEN_SERVER_URL = "https://token.services.mozilla.com/1.0/sync/1.5"
+
+# How many seconds before the hawk token expires to fetch a new one.
+REFRESH_MARGIN = 300
+
 def login(user):
     """
     Logs a user into their Firefox account and returns tempoary credentials
-    for use by AuthRequest.
+    for use by AuthRequest, along with the session used to renew them.
     """
-    # TODO: pull out the urls to be part of the config.
-    client = Client("https://api.accounts.firefox.com")
+    client = Client(ACCOUNTS_URL)
     session = client.login(user['email'], user['password'], keys=True)
 
     keyA,keyB = session.fetch_keys()
@@ -25,12 +36,34 @@ def login(user):
     encryption_key = keys[0:32]
     hmac_key = keys[32:64]
 
-    # TODO: Store this or a derived longer-lived token
-    #       Causes a login event which causes an email
+    # The session token is kept so that new hawk tokens can be fetched
+    # without logging in again, which causes a login event and an email.
     # TODO: Should move to use OAuth which solves the long-term cred storage
     #       issue
-    fxab = FxABrowserIDAuth(user['email'], user['password'], with_client_state=True)
-    raw_resp = requests.get('https://token.services.mozilla.com/1.0/sync/1.5', auth=fxab)
+    login_resp = {
+        'session_uid': session.uid,
+        'session_token': session.token,
+        'client_state': hashlib.sha256(keyB).hexdigest()[:32],
+
+        'encryption_key': encryption_key.hex(),
+        'hmac_key': hmac_key.hex(),
+    }
+    login_resp.update(fetch_hawk_token(session, login_resp['client_state']))
+    return login_resp
+
+def fetch_hawk_token(session, client_state):
+    """
+    Exchanges a logged in session for a new hawk token from the token server.
+    """
+    token_server = urlparse(TOKEN_SERVER_URL)
+    audience = f"{token_server.scheme}://{token_server.netloc}"
+    assertion = session.get_identity_assertion(audience)
+
+    headers = {
+        'Authorization': f"BrowserID {assertion}",
+        'X-Client-State': client_state,
+    }
+    raw_resp = requests.get(TOKEN_SERVER_URL, headers=headers)
     raw_resp.raise_for_status()
     hawk_resp = raw_resp.json()
 
@@ -43,25 +76,131 @@ def login(user):
         "hawk_key": hawk_resp['key'],
         "hawk_hashed_fxa_uid": hawk_resp['hashed_fxa_uid'],
         "hawk_id": hawk_resp['id'],
-
-        'encryption_key': encryption_key.hex(),
-        'hmac_key': hmac_key.hex(),
+        "hawk_issued_at": time.time(),
     }
 
+# FxA's errno for an invalid or revoked session token.
+# https://github.com/mozilla/fxa/blob/main/packages/fxa-auth-server/docs/api.md#response-format
+INVALID_TOKEN_ERRNO = 110
+
+def session_invalid(e):
+    """
+    Returns whether the error from renewing the hawk token means the session
+    token was revoked or expired, rather than some other failure.
+    """
+    if isinstance(e, ClientError):
+        return e.details.get('code') == 401 or e.details.get('errno') == INVALID_TOKEN_ERRNO
+    return e.response is not None and e.response.status_code == 401
+
+class CredentialManager:
+    """
+    Caches the credentials from login in the config file and renews the hawk
+    token shortly before it expires.
+
+    Renewing uses the cached session token, so only if that has been
+    revoked does it fall back to a full login.
+    """
+    def __init__(self, config, config_file_name, refresh_margin=REFRESH_MARGIN):
+        self.config           = config
+        self.config_file_name = config_file_name
+        self.refresh_margin   = refresh_margin
+        self.lock             = threading.Lock()
+
+    def credentials(self):
+        """
+        Returns a copy of the current credentials, renewing them first if
+        needed. It's a copy so that other threads renewing them can't change
+        it half way through a request.
+        """
+        with self.lock:
+            if 'login_resp' not in self.config:
+                self.save(login(self.config['user']))
+            elif self.expires_in() < self.margin():
+                self.refresh()
+            return dict(self.config['login_resp'])
+
+    def invalidate(self, hawk_id):
+        """
+        Renews the hawk token after the storage server rejected it. Does
+        nothing if another request has already replaced that token.
+        """
+        with self.lock:
+            if self.config['login_resp']['hawk_id'] == hawk_id:
+                self.refresh()
+
+    def expires_in(self):
+        """
+        Returns the number of seconds until the hawk token expires.
+        """
+        login_resp = self.config['login_resp']
+        if 'hawk_issued_at' not in login_resp:
+            return 0
+        expires_at = float(login_resp['hawk_issued_at']) + float(login_resp['hawk_duration'])
+        return expires_at - time.time()
+
+    def margin(self):
+        """
+        Returns how long before expiry to renew the hawk token. Never more
+        than half the token's lifetime, so a short lived token isn't
+        renewed on every request.
+        """
+        return min(self.refresh_margin, float(self.config['login_resp']['hawk_duration']) / 2)
+
+    def refresh(self):
+        """
+        Fetches a new hawk token, reusing the session and derived keys.
+        """
+        login_resp = self.config['login_resp']
+        if 'session_token' not in login_resp:
+            self.save(login(self.config['user']))
+            return
+
+        client = Client(ACCOUNTS_URL)
+        session = Session(client, self.config['user']['email'], None,
+                          login_resp['session_uid'], login_resp['session_token'])
+        try:
+            hawk = fetch_hawk_token(session, login_resp['client_state'])
+        except (ClientError, requests.exceptions.HTTPError) as e:
+            # Anything else, like being throttled, won't be fixed by a
+            # password login and would just send another email.
+            if not session_invalid(e):
+                raise e
+            self.save(login(self.config['user']))
+            return
+
+        updated = dict(login_resp)
+        updated.update(hawk)
+        self.save(updated)
+
+    def save(self, login_resp):
+        self.config['login_resp'] = login_resp
+        with open(self.config_file_name, 'w') as configfile:
+            self.config.write(configfile)
+
 class AuthRequest:
     """
     Provides a wrapper for making requests to the endpoint found when
     first authenticating and the tempoary credentials.
     """
-    def __init__(self, login_resp):
+    def __init__(self, credential_manager):
+        self.credential_manager = credential_manager
+
+        login_resp = credential_manager.credentials()
         self.encryption_key = bytes.fromhex(login_resp['encryption_key'])
         self.hmac_key       = bytes.fromhex(login_resp['hmac_key'])
         self.user_id        = login_resp['hawk_uid']
-        self.endpoint       = login_resp['hawk_api_endpoint']
-        self.hawk_auth      = HawkAuth(id=login_resp['hawk_id'], key=login_resp['hawk_key'])
 
-    def request(self, path, params=None):
-        path = f"{self.endpoint}/{path}"
-        raw_resp = requests.get(path, auth=self.hawk_auth, params=params)
+    def request(self, path, params=None, headers=None):
+        login_resp = self.credential_manager.credentials()
+        raw_resp = self.raw_request(login_resp, path, params, headers)
+        if raw_resp.status_code == 401:
+            self.credential_manager.invalidate(login_resp['hawk_id'])
+            login_resp = self.credential_manager.credentials()
+            raw_resp = self.raw_request(login_resp, path, params, headers)
         raw_resp.raise_for_status()
         return raw_resp
+
+    def raw_request(self, login_resp, path, params, headers):
+        path = f"{login_resp['hawk_api_endpoint']}/{path}"
+        hawk_auth = HawkAuth(id=login_resp['hawk_id'], key=login_resp['hawk_key'])
+        return requests.get(path, auth=hawk_auth, params=params, headers=headers)
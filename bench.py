@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+from configparser import ConfigParser
+from contextlib import redirect_stdout
+from cache import CachePolicy, ResponseCache
+from utils import Collections
+from bench_fixtures import SyncCorpus, QUERY_TERMS, page_text, start_page_server, start_sync_server
+import argparse
+import auth
+import db
+import io
+import json
+import os
+import page_fetcher
+import random
+import re
+import statistics
+import sync
+import tempfile
+import time
+
+def reset_db(conn):
+    """
+    Empties everything sync.py and page_fetcher.py write to.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            TRUNCATE history_entry, bookmark_entry, tab_entry, url_text,
+                     history_entry_url_text, bookmark_entry_url_text,
+                     sync_checkpoint
+            CASCADE
+        """)
+
+def bench_sync(db_config, sync_url, account_keypair, concurrency, config_file_name):
+    """
+    Runs a full sync against the fake storage server and returns the
+    number of seconds it took.
+    """
+    encryption_key, hmac_key = account_keypair
+    config = ConfigParser()
+    # A token that won't expire during the run, so the credential manager
+    # never tries to talk to the real token server.
+    config['login_resp'] = {
+        'encryption_key': encryption_key.hex(),
+        'hmac_key': hmac_key.hex(),
+        'hawk_uid': 1,
+        'hawk_api_endpoint': sync_url,
+        'hawk_id': 'bench',
+        'hawk_key': 'bench',
+        'hawk_duration': 10**9,
+        'hawk_issued_at': time.time(),
+    }
+    credentials = auth.CredentialManager(config, config_file_name)
+
+    start = time.perf_counter()
+    collections = Collections(auth.AuthRequest(credentials))
+    with redirect_stdout(io.StringIO()):
+        sync.sync(db_config, collections, concurrency)
+    return time.perf_counter() - start
+
+def bench_fetch(conn, entries, cache_file_name):
+    """
+    Fetches and stores the text of the entries from the fake page server,
+    returning the number of seconds it took.
+    """
+    cache = ResponseCache(cache_file_name, CachePolicy(ttl=60 * 60))
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for he in entries:
+            page_fetcher.fetch_text(conn, cache, he)
+    return time.perf_counter() - start
+
+def fill_text(conn, entries):
+    """
+    Stores the text of the entries straight from the corpus, so search is
+    run over every record without fetching them all.
+    """
+    for he in entries:
+        page = re.search(r"/page/(\d+)", he['url'])
+        if not page:
+            continue
+        title, headers, paragraphs = page_text(int(page.group(1)))
+        db.insert_url_text(conn, {
+            'history_entry_id': he['history_entry_id'],
+            'bookmark_entry_id': he['bookmark_entry_id'],
+            'url': he['url'],
+            'title': title,
+            'headers': " ".join(headers),
+            'processed_text': " ".join(paragraphs),
+            'http_status': 200,
+        })
+
+def bench_search(conn, searches):
+    """
+    Runs searches for random rare words from the corpus, returning the
+    latency of each in seconds.
+    """
+    rng = random.Random(0)
+    latencies = []
+    for _ in range(searches):
+        terms = " ".join(rng.sample(QUERY_TERMS, rng.randint(1, 2)))
+        start = time.perf_counter()
+        db.search_text(conn, terms)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark sync, page fetching and search against local fake servers.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help="number of history records to benchmark with")
+    parser.add_argument('--bookmark-ratio', type=float, default=0.05, help="bookmarks per history record")
+    parser.add_argument('--fetch-limit', type=int, default=2000, help="pages to fetch over HTTP at each size")
+    parser.add_argument('--no-fill', action='store_true', help="only search the fetched pages instead of every record")
+    parser.add_argument('--searches', type=int, default=200, help="searches to time at each size")
+    parser.add_argument('--concurrency', type=int, default=3, help="collections to sync at once")
+    parser.add_argument('--db-section', default='bench_db', help="config.ini section of the database to use, it will be emptied")
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    config_file_name = 'config.ini'
+
+    config = ConfigParser()
+    config.read(config_file_name)
+
+    db_config = {'db': config[args.db_section]}
+    conn = db.login(db_config)
+
+    page_process, page_url = start_page_server()
+    results = []
+    try:
+        for size in args.sizes:
+            reset_db(conn)
+
+            n_bookmarks = int(size * args.bookmark_ratio)
+            account_keypair = (os.urandom(32), os.urandom(32))
+            corpus = SyncCorpus(account_keypair, size, n_bookmarks, page_url)
+            sync_process, sync_url = start_sync_server(corpus)
+
+            with tempfile.TemporaryDirectory() as tmp:
+                try:
+                    sync_time = bench_sync(db_config, sync_url, account_keypair, args.concurrency, os.path.join(tmp, 'config.ini'))
+                finally:
+                    sync_process.terminate()
+
+                entries = db.get_history_bookmark_needing_text(conn)
+                fetched = entries[:args.fetch_limit]
+                fetch_time = bench_fetch(conn, fetched, os.path.join(tmp, 'page_cache.sqlite'))
+
+            if not args.no_fill:
+                fill_text(conn, entries[args.fetch_limit:])
+
+            latencies = bench_search(conn, args.searches)
+            if len(latencies) >= 2:
+                percentiles = statistics.quantiles(latencies, n=100)
+                p50, p99 = percentiles[49], percentiles[98]
+            else:
+                p50 = p99 = latencies[0] if latencies else 0.0
+
+            result = {
+                'size': size,
+                'records': size + n_bookmarks,
+                'sync_records_per_sec': (size + n_bookmarks) / sync_time,
+                'pages': len(fetched),
+                'fetch_pages_per_sec': len(fetched) / fetch_time if fetch_time else 0,
+                'search_p50_ms': p50 * 1000,
+                'search_p99_ms': p99 * 1000,
+            }
+            results.append(result)
+            print(f"{result['size']:>8} history | sync {result['sync_records_per_sec']:8.0f} rec/s | fetch {result['fetch_pages_per_sec']:6.1f} pages/s | search p50 {result['search_p50_ms']:8.2f} ms p99 {result['search_p99_ms']:8.2f} ms")
+    finally:
+        page_process.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+from urllib.parse import urlparse, parse_qs
+from Crypto.Cipher import AES
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+
+# The most common words the synthetic pages are made of.
+COMMON_WORDS = """
+    archive bicycle bookmark browser cache calendar camera canal carbon
+    castle cathedral cipher climate compiler concert cooking database desert
+    diesel dinosaur dragon election engine espresso festival firefox forest
+    fossil garden geology glacier granite guitar harbor history island
+    journal kernel keyboard lantern library lighthouse locomotive marathon
+    meadow medieval meteor migration mountain museum network notebook ocean
+    orchard origami painting pastry penguin physics pilgrim planet poetry
+    postgres python quantum railway recipe reef river robot saddle satellite
+    schema sculpture search server signal skyline sourdough spider stadium
+    storm subway sync telescope terminal theater thunder tomato tractor
+    tunnel typewriter valley vintage violin volcano voyage walnut weather
+    whale windmill winter wizard workshop zeppelin
+""".split()
+
+SYLLABLES = """
+    ba be bo bu da de do du fa fe fo ga ge go ka ke ko ku la le lo lu ma me
+    mo mu na ne no nu pa pe po pu ra re ro ru sa se so su ta te to tu va ve
+    vo za ze zo
+""".split()
+
+def make_vocabulary(size):
+    """
+    Returns the common words followed by made up ones, up to size words,
+    in order of how often they're used.
+    """
+    rng = random.Random(0)
+    words = list(COMMON_WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choices(SYLLABLES, k=rng.randint(3, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+# Word frequencies follow Zipf's law like real text does, so there is a
+# long tail of rare words for searches to be selective on.
+VOCABULARY = make_vocabulary(50000)
+ZIPF_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+# What the benchmark searches for. A word this rare is on a couple of
+# percent of pages at most.
+QUERY_TERMS = VOCABULARY[1000:]
+
+def words(rng, k):
+    return rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=k)
+
+# How far apart, in seconds, consecutive records were modified.
+MODIFIED_STEP = 0.01
+MODIFIED_BASE = 1500000000.0
+
+def record_modified(i):
+    return round(MODIFIED_BASE + i * MODIFIED_STEP, 2)
+
+def page_text(i):
+    """
+    Returns the (title, headers, body) of synthetic page i.
+    """
+    rng = random.Random(i)
+    title = " ".join(words(rng, 4)).title()
+    headers = [" ".join(words(rng, 3)).title() for _ in range(3)]
+    paragraphs = [" ".join(words(rng, rng.randint(40, 120))) for _ in range(len(headers))]
+    return (title, headers, paragraphs)
+
+def page_html(i):
+    """
+    Returns synthetic page i as an HTML document.
+    """
+    title, headers, paragraphs = page_text(i)
+    sections = "".join(f"<h2>{h}</h2><p>{p}</p>" for h, p in zip(headers, paragraphs))
+    return (
+        f"<html><head><title>{title}</title><script>var x = {i};</script></head>"
+        f"<body><nav>home about contact</nav><article><h1>{title}</h1>{sections}</article></body></html>"
+    )
+
+def history_record(i, page_url):
+    """
+    Returns history record i in the format Firefox uploads it.
+    """
+    rng = random.Random(-i - 1)
+    last = int(record_modified(i) * 1000000)
+    visits = [{'date': last - rng.randint(0, 10**10), 'type': 1} for _ in range(rng.randint(1, 5))]
+    return {
+        'id': f"hist{i:08d}",
+        'histUri': f"{page_url}/page/{i}?utm_source=bench",
+        'title': page_text(i)[0],
+        'visits': visits,
+    }
+
+def bookmark_record(i, page_url, n_folders):
+    """
+    Returns bookmark record i, the first n_folders of which are folders the
+    rest are filed into.
+    """
+    if i < n_folders:
+        return {
+            'id': f"folder{i:07d}",
+            'type': 'folder',
+            'title': f"Folder {i}",
+            'parentid': 'toolbar',
+            'dateAdded': int(record_modified(i) * 1000),
+        }
+    rng = random.Random(i)
+    return {
+        'id': f"bmk{i:08d}",
+        'type': 'bookmark',
+        'title': page_text(i)[0],
+        'bmkUri': f"{page_url}/page/{i}#bookmark",
+        'parentid': f"folder{rng.randrange(n_folders):07d}",
+        'dateAdded': int(record_modified(i) * 1000),
+    }
+
+def encrypt_bso(record, modified, keypair):
+    """
+    Returns the record as a BSO encrypted and signed the way
+    utils.Collection expects.
+    """
+    encryption_key, hmac_key = keypair
+    plaintext = json.dumps(record).encode('utf-8')
+    # PKCS7 padding
+    pad = 16 - len(plaintext) % 16
+    plaintext += bytes([pad]) * pad
+
+    iv = os.urandom(16)
+    ciphertext_b64 = b64encode(AES.new(encryption_key, AES.MODE_CBC, iv).encrypt(plaintext))
+    payload = {
+        'ciphertext': ciphertext_b64.decode('ascii'),
+        'IV': b64encode(iv).decode('ascii'),
+        'hmac': hmac.new(key=hmac_key, msg=ciphertext_b64, digestmod=hashlib.sha256).hexdigest(),
+    }
+    return {
+        'id': record['id'],
+        'modified': modified,
+        'payload': json.dumps(payload),
+    }
+
+class SyncCorpus:
+    """
+    A synthetic account with n_history history and n_bookmarks bookmark
+    records. Records are generated from their index when asked for, so
+    a million of them doesn't need to fit in memory.
+    """
+    def __init__(self, account_keypair, n_history, n_bookmarks, page_url):
+        self.account_keypair = account_keypair
+        self.collection_keypair = (os.urandom(32), os.urandom(32))
+        self.page_url = page_url
+        self.n_folders = max(1, n_bookmarks // 50)
+
+        self.counts = {
+            'history': n_history,
+            'bookmarks': n_bookmarks,
+        }
+
+    def count(self, collection):
+        if collection == 'crypto':
+            return 1
+        return self.counts[collection]
+
+    def last_modified(self, collection):
+        return record_modified(max(self.count(collection) - 1, 0))
+
+    def collections(self):
+        return ['crypto'] + list(self.counts.keys())
+
+    def bso(self, collection, i):
+        if collection == 'crypto':
+            record = {
+                'id': 'keys',
+                'collection': 'crypto',
+                'default': [b64encode(k).decode('ascii') for k in self.collection_keypair],
+                'collections': {},
+            }
+            return encrypt_bso(record, record_modified(0), self.account_keypair)
+        if collection == 'history':
+            record = history_record(i, self.page_url)
+        else:
+            record = bookmark_record(i, self.page_url, self.n_folders)
+        return encrypt_bso(record, record_modified(i), self.collection_keypair)
+
+class SyncHandler(BaseHTTPRequestHandler):
+    """
+    Answers the parts of the Sync 1.5 storage API that utils.Collections
+    uses. Hawk headers are accepted without being checked.
+    """
+    corpus = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        # /1.5/<uid>/<rest>
+        parts = url.path.strip('/').split('/')[2:]
+        query = parse_qs(url.query)
+        corpus = self.corpus
+
+        if parts == ['info', 'collections']:
+            return self.send_json({c: corpus.last_modified(c) for c in corpus.collections()})
+        if parts == ['info', 'collection_counts']:
+            return self.send_json({c: corpus.count(c) for c in corpus.collections()})
+        if parts == ['info', 'collection_usage']:
+            # Roughly what an encrypted history record weighs.
+            return self.send_json({c: corpus.count(c) * 0.6 for c in corpus.collections()})
+        if len(parts) == 2 and parts[0] == 'storage' and parts[1] in corpus.collections():
+            return self.send_collection(parts[1], query)
+        self.send_error(404)
+
+    def send_collection(self, collection, query):
+        corpus = self.corpus
+        last_modified = f"{corpus.last_modified(collection):.2f}"
+
+        if_unmodified = self.headers.get('X-If-Unmodified-Since')
+        if if_unmodified and float(if_unmodified) < float(last_modified):
+            return self.send_error(412)
+
+        # Records are generated oldest first, so newer is just a start index.
+        start = 0
+        if 'newer' in query:
+            newer = float(query['newer'][0])
+            start = max(0, int((newer - MODIFIED_BASE) / MODIFIED_STEP) + 1)
+        if 'offset' in query:
+            start = int(query['offset'][0])
+        n = corpus.count(collection)
+        limit = int(query['limit'][0]) if 'limit' in query else n
+        end = min(n, start + limit)
+
+        headers = {'X-Last-Modified': last_modified}
+        if end < n:
+            headers['X-Weave-Next-Offset'] = str(end)
+
+        if 'full' in query:
+            items = [corpus.bso(collection, i) for i in range(start, end)]
+        else:
+            items = [corpus.bso(collection, i)['id'] for i in range(start, end)]
+        self.send_json(items, headers)
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    Serves synthetic page i at /page/i.
+    """
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'page' or not parts[1].isdigit():
+            return self.send_error(404)
+        body = page_html(int(parts[1])).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(handler, port_queue):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def serve_sync(corpus, port_queue):
+    SyncHandler.corpus = corpus
+    serve(SyncHandler, port_queue)
+
+def start_server(target, *args):
+    """
+    Runs the server in its own process, so generating and encrypting records
+    doesn't compete with the client for the GIL, and returns
+    (process, base_url).
+    """
+    port_queue = Queue()
+    process = Process(target=target, args=args + (port_queue,), daemon=True)
+    process.start()
+    return (process, f"http://127.0.0.1:{port_queue.get()}")
+
+def start_page_server():
+    return start_server(serve, PageHandler)
+
+def start_sync_server(corpus):
+    process, url = start_server(serve_sync, corpus)
+    return (process, f"{url}/1.5/1")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+import time
+import zlib
+import requests
+from requests.structures import CaseInsensitiveDict
+
+class CachePolicy:
+    """
+    How the responses for one use are cached.
+
+    * ttl - seconds a response is served from the cache, None for forever
+    * max_bytes - size of the stored bodies before the least recently used
+      are evicted, None for unbounded
+    * compress - whether to zlib the bodies before storing them
+    """
+    def __init__(self, ttl=None, max_bytes=None, compress=True):
+        self.ttl       = ttl
+        self.max_bytes = max_bytes
+        self.compress  = compress
+
+class ResponseCache:
+    """
+    A SQLite backed cache of successful GET responses.
+
+    Only meant for unauthenticated requests, like fetching pages. Calls to
+    the Sync API shouldn't be cached since we'd never see new data.
+    """
+    def __init__(self, path, policy):
+        self.policy = policy
+        self.db     = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS response (
+                url text PRIMARY KEY,
+                status_code integer NOT NULL,
+                headers text NOT NULL,
+                encoding text,
+                compressed integer NOT NULL,
+                body blob NOT NULL,
+                size integer NOT NULL,
+                raw_size integer NOT NULL,
+                created_at real NOT NULL,
+                last_access real NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS response_last_access ON response(last_access);
+            CREATE TABLE IF NOT EXISTS stats (
+                name text PRIMARY KEY,
+                value integer NOT NULL
+            );
+        """)
+        self.db.commit()
+
+    def get(self, url, headers=None):
+        """
+        Returns the response for the url, from the cache if it has a fresh
+        copy and from the network otherwise.
+        """
+        if response := self.lookup(url):
+            self.count('hits')
+            self.count('bytes_saved', len(response.content))
+            return response
+
+        self.count('misses')
+        response = requests.get(url, headers=headers)
+        if response.status_code == requests.codes.ok:
+            self.store(url, response)
+        return response
+
+    def lookup(self, url):
+        row = self.db.execute("""
+            SELECT status_code, headers, encoding, compressed, body, created_at
+            FROM response
+            WHERE url = ?
+        """, (url,)).fetchone()
+        if row is None:
+            return None
+
+        status_code, headers, encoding, compressed, body, created_at = row
+        now = time.time()
+        if self.policy.ttl is not None and created_at + self.policy.ttl < now:
+            self.db.execute("DELETE FROM response WHERE url = ?", (url,))
+            self.db.commit()
+            return None
+
+        self.db.execute("UPDATE response SET last_access = ? WHERE url = ?", (now, url))
+        self.db.commit()
+
+        response = requests.Response()
+        response.url         = url
+        response.status_code = status_code
+        response.headers     = CaseInsensitiveDict(json.loads(headers))
+        response.encoding    = encoding
+        response._content    = zlib.decompress(body) if compressed else body
+        return response
+
+    def store(self, url, response):
+        body = response.content
+        raw_size = len(body)
+        if self.policy.compress:
+            body = zlib.compress(body)
+
+        # Don't bother keeping something that would evict everything else.
+        if self.policy.max_bytes is not None and len(body) > self.policy.max_bytes:
+            return
+
+        now = time.time()
+        self.db.execute("""
+            INSERT OR REPLACE INTO response
+            (url, status_code, headers, encoding, compressed, body, size, raw_size, created_at, last_access)
+            VALUES
+            (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            url,
+            response.status_code,
+            json.dumps(dict(response.headers)),
+            response.encoding,
+            self.policy.compress,
+            body,
+            len(body),
+            raw_size,
+            now,
+            now,
+        ))
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        """
+        Removes the least recently used responses until the cache fits in
+        max_bytes.
+        """
+        if self.policy.max_bytes is None:
+            return
+        total, = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM response").fetchone()
+        if total <= self.policy.max_bytes:
+            return
+
+        evicted = []
+        for url, size in self.db.execute("SELECT url, size FROM response ORDER BY last_access"):
+            evicted.append((url,))
+            total -= size
+            if total <= self.policy.max_bytes:
+                break
+        self.db.executemany("DELETE FROM response WHERE url = ?", evicted)
+        self.count('evictions', len(evicted))
+
+    def count(self, name, n=1):
+        self.db.execute("""
+            INSERT INTO stats (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """, (name, n))
+        self.db.commit()
+
+    def stats(self):
+        """
+        Returns the hits, misses, hit_rate, bytes_saved and evictions over
+        the life of the cache, along with its current size.
+        """
+        stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'evictions': 0}
+        stats.update(self.db.execute("SELECT name, value FROM stats").fetchall())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+
+        size, raw_size, n = self.db.execute("""
+            SELECT COALESCE(SUM(size), 0), COALESCE(SUM(raw_size), 0), COUNT(*)
+            FROM response
+        """).fetchone()
+        stats['size'] = size
+        stats['raw_size'] = raw_size
+        stats['responses'] = n
+        return stats
@@ -78,6 +78,18 @@ def clean_url(url):
     )
     return urlunparse(newparts)
 
+INSERTERS = {}
+
+def inserter_for(collection):
+    """
+    Registers the decorated inserter as the one used to sync the collection.
+    """
+    def register(inserter):
+        INSERTERS[collection] = inserter
+        return inserter
+    return register
+
+@inserter_for('bookmarks')
 class BookmarkInserter:
     """
     Provides a context manager for inserting bookmarks.
@@ -89,7 +101,6 @@ class BookmarkInserter:
     def __init__(self, conn):
         self.conn = conn
     def __enter__(self):
-        self.parents = {}
         self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         return self
 
@@ -106,9 +117,13 @@ class BookmarkInserter:
             'modified': None,
             'bmkUri': None,
             'clean_url': None,
+            'parent_guid': None,
         }
         insert_data.update(bookmark)
 
+        if 'parentid' in bookmark and bookmark['parentid'] not in ['places', 'unfiled']:
+            insert_data['parent_guid'] = bookmark['parentid']
+
         if 'bmkUri' in insert_data:
             insert_data['clean_url'] = clean_url(insert_data['bmkUri'])
 
@@ -117,36 +132,38 @@ class BookmarkInserter:
         # things then this shouldn't be an issue.
         self.cursor.execute("""
             INSERT INTO bookmark_entry 
-            (bookmark_entry_id, bookmark_type, title, url, date_added, deleted, modified, clean_url)
+            (bookmark_entry_id, bookmark_type, title, url, date_added, deleted, modified, clean_url, parent_guid)
             VALUES
-            (%(id)s, %(type)s, %(title)s, %(bmkUri)s, TO_TIMESTAMP(%(dateAdded)s/1000), %(deleted)s, TO_TIMESTAMP(%(modified)s), %(clean_url)s)
+            (%(id)s, %(type)s, %(title)s, %(bmkUri)s, TO_TIMESTAMP(%(dateAdded)s/1000), %(deleted)s, TO_TIMESTAMP(%(modified)s), %(clean_url)s, %(parent_guid)s)
             ON CONFLICT(bookmark_entry_id)
                 DO UPDATE SET
                     title = EXCLUDED.title,
                     modified = EXCLUDED.modified,
                     url = EXCLUDED.url,
-                    clean_url = EXCLUDED.clean_url
+                    clean_url = EXCLUDED.clean_url,
+                    parent_guid = EXCLUDED.parent_guid
         """, insert_data)
-        i = len(self.parents)
-        if 'parentid' in bookmark and bookmark['parentid'] not in ['places', 'unfiled']:
-            self.parents[f"child_{i}"] = bookmark['id']
-            self.parents[f"parent_{i}"] = bookmark['parentid']
+
+    def flush(self):
+        """
+        Links every bookmark whose parent has been inserted.
+        """
+        self.insert_bookmark_parents()
 
     def insert_bookmark_parents(self):
-        # Since mass updates from literals isn't quite a thing in SQL,
-        # let's create a temp table using a CTE, fill it, and do a mass update
-        # via a joined update query.
-
-        # While I'm OK doing the inserts one-at-a time because I don't already
-        # have a list of everything, I have a list of everything here and
-        # updates in a loop pain me.
-        if len(self.parents) < 1:
-            return
-        sql  = f"WITH bookmark_parent AS ("
-        sql += " UNION ".join(map(lambda i: f"SELECT %(child_{i})s as childid, %(parent_{i})s as parentid", range(0,len(self.parents),2)))
-        sql += f") UPDATE bookmark_entry SET parent_id = parentid FROM bookmark_parent WHERE bookmark_entry_id = childid"
-        self.cursor.execute(sql, self.parents);
+        # The parent's id is kept in parent_guid, which isn't a foreign key,
+        # until the parent shows up. Since this is called after every page
+        # and pending links live in the db, a resumed sync still links
+        # children from the pages before its checkpoint.
+        self.cursor.execute("""
+            UPDATE bookmark_entry
+            SET parent_id = parent.bookmark_entry_id
+            FROM bookmark_entry AS parent
+            WHERE parent.bookmark_entry_id = bookmark_entry.parent_guid
+              AND bookmark_entry.parent_id IS DISTINCT FROM bookmark_entry.parent_guid
+        """)
 
+@inserter_for('history')
 class HistoryInserter:
     """
     Provides a context manager for inserting history entries.
@@ -160,6 +177,13 @@ class HistoryInserter:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.cursor.close()
 
+    def flush(self):
+        """
+        History entries are written as they're inserted, so there is
+        nothing left to do at the end of a page.
+        """
+        pass
+
     def insert(self, history_entry):
         def reducer(c, e):
             if c is None:
@@ -197,6 +221,57 @@ class HistoryInserter:
                     clean_url = EXCLUDED.clean_url
         """, insert_data)
 
+@inserter_for('tabs')
+class TabInserter:
+    """
+    Provides a context manager for inserting the open tabs of each client.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+    def __enter__(self):
+        self.cursor = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cursor.close()
+
+    def flush(self):
+        """
+        Tabs are written as they're inserted, so there is nothing left to
+        do at the end of a page.
+        """
+        pass
+
+    def insert(self, client_tabs):
+        # Each record is the whole set of tabs open on one client, so
+        # replace whatever we had for it.
+        self.cursor.execute("DELETE FROM tab_entry WHERE client_id = %s", (client_tabs['id'],))
+        if client_tabs.get('deleted'):
+            return
+
+        for tab in client_tabs.get('tabs', []):
+            if not tab.get('urlHistory'):
+                continue
+            insert_data = {
+                'client_id': client_tabs['id'],
+                'client_name': client_tabs.get('clientName'),
+                'url': tab['urlHistory'][0],
+                'clean_url': clean_url(tab['urlHistory'][0]),
+                'title': tab.get('title'),
+                'last_used': tab.get('lastUsed'),
+                'modified': client_tabs['modified'],
+            }
+            self.cursor.execute("""
+                INSERT INTO tab_entry
+                (client_id, client_name, url, clean_url, title, last_used, modified)
+                VALUES
+                (%(client_id)s, %(client_name)s, %(url)s, %(clean_url)s, %(title)s, TO_TIMESTAMP(%(last_used)s::double precision), TO_TIMESTAMP(%(modified)s))
+                ON CONFLICT(client_id, url)
+                    DO UPDATE SET
+                        title = EXCLUDED.title,
+                        last_used = GREATEST(tab_entry.last_used, EXCLUDED.last_used)
+            """, insert_data)
+
 def get_history_bookmark_needing_text(conn):
     """
     Returns history and bookmarks needing their text fetched.
@@ -307,6 +382,53 @@ def last_history_time(conn):
         max_lv = cursor.fetchone()
         return max_lv['last_visited']
 
+def get_sync_checkpoint(conn, collection):
+    """
+    Returns the paging checkpoint left by an unfinished sync of the
+    collection, or None if the last sync finished.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.execute("""
+            SELECT collection, next_offset, last_modified, records_committed, newer, last_record_modified, last_record_ids
+            FROM sync_checkpoint
+            WHERE collection = %s
+        """, (collection,))
+        return cursor.fetchone()
+
+def save_sync_checkpoint(conn, collection, next_offset, last_modified, records_committed, newer=None, last_record_modified=None, last_record_ids=None):
+    """
+    Records where to continue syncing the collection from. last_modified is
+    the X-Last-Modified of the collection the next_offset token belongs to
+    and newer is the filter the token was handed out for.
+    last_record_modified is the modified time of the last committed record,
+    to continue from if the token has gone stale, and last_record_ids are
+    the committed records with that same modified time.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.execute("""
+            INSERT INTO sync_checkpoint
+            (collection, next_offset, last_modified, records_committed, newer, last_record_modified, last_record_ids, updated_at)
+            VALUES
+            (%s, %s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT(collection)
+                DO UPDATE SET
+                    next_offset = EXCLUDED.next_offset,
+                    last_modified = EXCLUDED.last_modified,
+                    records_committed = EXCLUDED.records_committed,
+                    newer = EXCLUDED.newer,
+                    last_record_modified = EXCLUDED.last_record_modified,
+                    last_record_ids = EXCLUDED.last_record_ids,
+                    updated_at = EXCLUDED.updated_at
+        """, (collection, next_offset, last_modified, records_committed, newer, last_record_modified, last_record_ids))
+
+def clear_sync_checkpoint(conn, collection):
+    """
+    Forgets the checkpoint for the collection so the next sync starts from
+    the first page.
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+        cursor.execute("DELETE FROM sync_checkpoint WHERE collection = %s", (collection,))
+
 def search_text(conn, search_query):
     """
     Does a simple full-text-search for the search_query.
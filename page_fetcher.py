@@ -4,21 +4,11 @@ import requests
 import requests.exceptions
 from configparser import ConfigParser
 import db
-import requests_cache
+from cache import CachePolicy, ResponseCache
 from readability import Document
 from bs4 import BeautifulSoup
 import psycopg2
 
-requests_cache.install_cache('page_fetcher_cache')
-
-
-config_file_name = 'config.ini'
-
-config = ConfigParser()
-config.read(config_file_name)
-
-conn = db.login(config)
-
 def extract_content_text(soup):
     """
     Extracts (processed_text:str, headers: str) from the bs4 node.
@@ -42,15 +32,15 @@ def extract_content_text(soup):
         return (body.text, headers)
     return ("", "")
 
-i = 0
 ua_header = {
     'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:67.0) Gecko/20100101 Firefox/67.0',
     'Accept': 'text/html',
 }
-for he in db.get_history_bookmark_needing_text(conn):
-    i += 1
-    if i % 1 == 0:
-        print(f"On record {i} {he['url']}")
+
+def fetch_text(conn, cache, he):
+    """
+    Fetches the page for a history or bookmark entry and stores its text.
+    """
     url_text = {
         'history_entry_id': he['history_entry_id'],
         'bookmark_entry_id': he['bookmark_entry_id'],
@@ -58,25 +48,25 @@ for he in db.get_history_bookmark_needing_text(conn):
         'url': he['url'],
     }
     try:
-        response = requests.get(he['url'], headers=ua_header)
+        response = cache.get(he['url'], headers=ua_header)
     except requests.exceptions.RequestException as e:
         print(f"{he['url']} {e}")
         url_text['http_status'] = -300
         db.insert_url_text(conn, url_text)
-        continue
+        return
 
     url_text['http_status'] = response.status_code
 
     if response.status_code != requests.codes.ok:
         print(f"{he['url']} returned code {response.status_code}")
         db.insert_url_text(conn, url_text)
-        continue
+        return
 
     # TODO: Add content-type and per-site handlers
     if 'Content-Type' in response.headers and 'text/html' not in response.headers['Content-Type']:
         print(f"{he['url']} is not HTML (is {response.headers['Content-Type']})")
         db.insert_url_text(conn, url_text)
-        continue
+        return
 
     soup = BeautifulSoup(response.text, 'html.parser')
     processed_text, headers = extract_content_text(soup)
@@ -104,3 +94,28 @@ for he in db.get_history_bookmark_needing_text(conn):
         else:
             raise e
 
+def main():
+    config_file_name = 'config.ini'
+
+    config = ConfigParser()
+    config.read(config_file_name)
+
+    conn = db.login(config)
+
+    cache = ResponseCache('page_cache.sqlite', CachePolicy(
+        ttl=config.getint('page_fetcher', 'cache_ttl', fallback=7 * 24 * 60 * 60),
+        max_bytes=config.getint('page_fetcher', 'cache_max_bytes', fallback=512 * 1024 * 1024),
+    ))
+
+    i = 0
+    for he in db.get_history_bookmark_needing_text(conn):
+        i += 1
+        if i % 1 == 0:
+            print(f"On record {i} {he['url']}")
+        fetch_text(conn, cache, he)
+
+    stats = cache.stats()
+    print(f"cache: {stats['hit_rate']:.1%} hit rate, {stats['bytes_saved']} bytes saved, {stats['size']} bytes stored ({stats['raw_size']} uncompressed)")
+
+if __name__ == '__main__':
+    main()
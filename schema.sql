@@ -29,11 +29,14 @@ create table bookmark_entry (
   title text,
   bookmark_type text,
   parent_id text references bookmark_entry,
+  -- the parent's id as synced, until parent_id can point at it
+  parent_guid text,
   url text,
   clean_url text,
   modified timestamp,
   deleted boolean default false
 );
+create index on bookmark_entry(parent_guid);
 
 create table bookmark_tag (
   bookmark_tag_id serial primary key,
@@ -79,3 +82,25 @@ create table bookmark_entry_url_text (
   primary key (url_text_id, bookmark_entry_id),
   unique (bookmark_entry_id, url_text_id)
 );
+
+create table tab_entry (
+  client_id text not null,
+  client_name text,
+  url text not null,
+  clean_url text,
+  title text,
+  last_used timestamp,
+  modified timestamp,
+  primary key (client_id, url)
+);
+
+create table sync_checkpoint (
+  collection text primary key,
+  next_offset text not null,
+  last_modified text not null,
+  records_committed integer not null default 0,
+  newer text,
+  last_record_modified text,
+  last_record_ids text[],
+  updated_at timestamp not null default now()
+);
@@ -1,54 +1,156 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from configparser import ConfigParser
-from utils import Collections
+import time
+from utils import Collections, CollectionModified
 import auth
 import db
 
-import requests_cache
-requests_cache.install_cache('demo_cache')
-
-
-config_file_name = 'config.ini'
-
-config = ConfigParser()
-config.read(config_file_name)
-
-conn = db.login(config)
-
-login_resp = None
-if 'login_resp' not in config:
-    login_resp = auth.login(config['user'])
-
-    config['login_resp'] = login_resp
-    with open(config_file_name, 'w') as configfile:
-        config.write(configfile)
-else:
-    login_resp = config['login_resp']
-
-auth_request = auth.AuthRequest(login_resp)
-
-collections = Collections(auth_request)
-
-print("bookmarks");
-i = 0
-n = len(collections['bookmarks'].keys())
-with db.BookmarkInserter(conn) as bi:
-    for item, bookmark in collections["bookmarks"].items():
-        bi.insert(bookmark)
-        i+=1
-        if i % 100 == 0:
-            p = (100.0 * i) / n
-            print(f"{i} of {n} ({p}%)")
-
-print("history");
-i = 0
-n = len(collections["history"].keys())
-print(db.last_history_time(conn))
-with db.HistoryInserter(conn) as hi:
-    for item, history_entry in collections["history"].items():
-        hi.insert(history_entry)
-        i+=1
-        if i % 100 == 0:
-            p = (100.0 * i) / n
-            print(f"{i} of {n} ({p}%)")
+class Progress:
+    """
+    Reports how far through a collection we are and how long is left.
+
+    The totals come from info/collection_counts and info/collection_usage
+    so no ids need to be listed up front.
+    """
+    def __init__(self, name, count, usage_kb):
+        self.name     = name
+        self.count    = count
+        self.usage_kb = usage_kb
+
+        self.start_i    = 0
+        self.start_time = time.monotonic()
+
+    def start(self, i):
+        self.start_i    = i
+        self.start_time = time.monotonic()
+        print(f"{self.name}: {self.count} records, {self.usage_kb:.0f} KB")
+
+    def report(self, i):
+        elapsed = time.monotonic() - self.start_time
+        rate    = (i - self.start_i) / elapsed if elapsed > 0 else 0
+        p       = min((100.0 * i) / self.count, 100.0) if self.count else 100.0
+        msg     = f"{self.name}: {i} of {self.count} ({p:.1f}%)"
+        if rate > 0:
+            eta = max(self.count - i, 0) / rate
+            kbps = rate * self.usage_kb / self.count if self.count else 0
+            msg += f" {rate:.0f} rec/s {kbps:.0f} KB/s eta {eta:.0f}s"
+        print(msg)
+
+def sync_collection(conn, collection, inserter, progress):
+    """
+    Inserts every item of the collection, checkpointing after each page so
+    an interrupted sync continues where it stopped.
+    """
+    name = collection.collection
+
+    checkpoint = db.get_sync_checkpoint(conn, name)
+    offset, last_modified, newer, i = None, None, None, 0
+    # The modified time of the last record of the last committed page, and
+    # the ids of the committed records sharing it.
+    committed_modified, committed_ids = None, set()
+    if checkpoint:
+        offset             = checkpoint['next_offset']
+        last_modified      = checkpoint['last_modified']
+        newer              = checkpoint['newer']
+        committed_modified = checkpoint['last_record_modified']
+        committed_ids      = set(checkpoint['last_record_ids'] or [])
+        i                  = checkpoint['records_committed']
+        print(f"resuming {name} from record {i}")
+    progress.start(i)
+
+    last_seen_modified, last_seen_ids = None, set()
+    def on_page(next_offset, page_last_modified, page_size):
+        nonlocal committed_modified, committed_ids
+        inserter.flush()
+        if last_seen_modified is not None:
+            committed_modified = str(last_seen_modified)
+            committed_ids      = set(last_seen_ids)
+        if next_offset:
+            db.save_sync_checkpoint(conn, name, next_offset, page_last_modified, i, newer, committed_modified, sorted(committed_ids))
+        else:
+            db.clear_sync_checkpoint(conn, name)
+
+    while True:
+        try:
+            for item, record in collection.items(newer=newer, offset=offset, last_modified=last_modified, on_page=on_page):
+                inserter.insert(record)
+                if record['modified'] != last_seen_modified:
+                    last_seen_modified, last_seen_ids = record['modified'], set()
+                last_seen_ids.add(item)
+                # Continuing after a stale offset fetches the records that
+                # share the last committed timestamp again. They've already
+                # been counted.
+                if str(record['modified']) == committed_modified and item in committed_ids:
+                    continue
+                i+=1
+                if i % 100 == 0:
+                    progress.report(i)
+            progress.report(i)
+            return
+        except CollectionModified:
+            # The offset token is no good anymore.
+            offset, last_modified = None, None
+            if committed_modified is None:
+                print(f"{name} changed on the server, starting over")
+                newer, i = None, 0
+                committed_ids = set()
+                db.clear_sync_checkpoint(conn, name)
+                progress.start(i)
+            else:
+                # Items come oldest first, so everything up to the last
+                # committed one is in. Step back one tick of the server's
+                # clock in case the next page shares its timestamp; upserts
+                # are idempotent so seeing a few again is fine.
+                newer = f"{float(committed_modified) - 0.01:.2f}"
+                print(f"{name} changed on the server, continuing from {newer}")
+
+def sync(config, collections, concurrency):
+    """
+    Syncs every collection we have an inserter for, up to concurrency at a
+    time, each on its own database connection.
+    """
+    def sync_one(name, progress):
+        worker_conn = db.login(config)
+        try:
+            with db.INSERTERS[name](worker_conn) as inserter:
+                sync_collection(worker_conn, collections[name], inserter, progress)
+        finally:
+            worker_conn.close()
+
+    counts = collections.counts()
+    usage  = collections.usage()
+    def progress_for(name):
+        return Progress(name, counts.get(name, 0), usage.get(name, 0))
+
+    # Only sync what we know how to store and the server actually has. Start
+    # the biggest first so the smaller ones fill in around it.
+    to_sync = [name for name in collections.keys() if name in db.INSERTERS]
+    to_sync.sort(key=lambda name: counts.get(name, 0), reverse=True)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(sync_one, name, progress_for(name)): name for name in to_sync}
+        for future in as_completed(futures):
+            # Re-raises anything that went wrong in the worker.
+            future.result()
+            print(f"{futures[future]} done")
+
+def main():
+    config_file_name = 'config.ini'
+
+    config = ConfigParser()
+    config.read(config_file_name)
+
+    conn = db.login(config)
+    print(db.last_history_time(conn))
+
+    credentials = auth.CredentialManager(config, config_file_name)
+    auth_request = auth.AuthRequest(credentials)
+
+    collections = Collections(auth_request)
+
+    sync(config, collections, config.getint('sync', 'concurrency', fallback=3))
+
+if __name__ == '__main__':
+    main()
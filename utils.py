@@ -5,6 +5,14 @@ import json
 from Crypto.Cipher import AES
 import hashlib 
 import hmac
+import requests
+
+class CollectionModified(Exception):
+    """
+    Raised when a collection changed on the server while it was being paged
+    through, which invalidates the X-Weave-Next-Offset token.
+    """
+    pass
 
 class AES_HMAC_KeyPairs:
     """
@@ -54,11 +62,28 @@ class Collections:
                 self.keypairs[collection] = process_keypair(keypair)
 
     def keys(self):
-        #TODO: Include newest item's time
+        """
+        Returns a dict of collection name to the last-modified time of its
+        newest item.
+        """
         resp = self.auth_request.request(f"info/collections")
         collections = resp.json()
         return collections
 
+    def counts(self):
+        """
+        Returns a dict of collection name to the number of items in it.
+        """
+        resp = self.auth_request.request(f"info/collection_counts")
+        return resp.json()
+
+    def usage(self):
+        """
+        Returns a dict of collection name to the size of its items in KB.
+        """
+        resp = self.auth_request.request(f"info/collection_usage")
+        return resp.json()
+
     def items(self):
         for collection in self.keys():
             yield (collection, self[collection])
@@ -76,7 +101,8 @@ class Collection:
         self.auth_request = auth_request
 
         self.cache  = {}
-        self.next_offset = None
+        self.next_offset   = None
+        self.last_modified = None
 
     def path(self, item=None):
         p = f"storage/{self.collection}"
@@ -106,25 +132,46 @@ class Collection:
 
         return items
 
-    def items(self, newer=None):
+    def items(self, newer=None, offset=None, last_modified=None, on_page=None):
         """
         Returns an iterator over all items in the collection.
 
         Fetched 1000 at a time in full, sorted by oldest first.
+
+        Passing the offset and last_modified from a previous run continues
+        paging from there. Once every item of a page has been consumed,
+        on_page is called with the next offset (None after the last page),
+        the collection's X-Last-Modified and the size of the page.
+
+        Raises CollectionModified if the collection changed since
+        last_modified or since the first page was fetched.
         """
         params = {
             'sort': 'oldest',
             'limit': 1000,
             'full': True,
         }
+        self.next_offset   = offset
+        self.last_modified = last_modified
         first = True
         while first or self.next_offset:
             first = False
+            headers = {}
             if self.next_offset:
                 params['offset'] = self.next_offset
             if newer:
                 params['newer'] = newer
-            resp = self.auth_request.request(self.path(), params)
+            # Offsets are only meaningful for the version of the collection
+            # they were handed out for.
+            # https://mozilla-services.readthedocs.io/en/latest/storage/apis-1.5.html#concurrency-and-conflict-management
+            if self.last_modified:
+                headers['X-If-Unmodified-Since'] = self.last_modified
+            try:
+                resp = self.auth_request.request(self.path(), params, headers)
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 412:
+                    raise CollectionModified(self.collection) from e
+                raise e
             items = resp.json()
 
             if 'X-Weave-Next-Offset' in resp.headers:
@@ -132,6 +179,10 @@ class Collection:
             else:
                 self.next_offset = None
 
+            if 'X-Last-Modified' in resp.headers:
+                self.last_modified = resp.headers['X-Last-Modified']
+
+            self.cache = {}
             if type(items) is list:
                 if len(items) > 0:
                     test = items[0]
@@ -140,6 +191,9 @@ class Collection:
             for item in self.cache.keys():
                 yield (item, self[item])
 
+            if on_page:
+                on_page(self.next_offset, self.last_modified, len(self.cache))
+
     def __getitem__(self, item):
         """
         Returns a the authenticated and decrypted item from the collection.